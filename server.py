@@ -1,11 +1,25 @@
 import os
+import re
+import atexit
+import asyncio
+import mmap
+import hashlib
 import logging
-from dataclasses import dataclass
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from itertools import islice
+from typing import AsyncIterator, BinaryIO, Iterator
 from dotenv import load_dotenv
-from fastmcp import Context, FastMCP
-from mcp.server.fastmcp.prompts.base import Message
+from fastmcp import FastMCP
+from fastmcp.prompts import Message, PromptMessage
+
+try:
+    import uvloop  # faster event loop, installed everywhere except Windows (see pyproject.toml)
+except ImportError:
+    uvloop = None
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,21 +27,77 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-@dataclass
+_WORD_RE = re.compile(r"\w+")
+_SEARCH_CACHE_SIZE = 1024
+
+@dataclass(slots=True)
 class RAGContext:
     """Context for RAG operations"""
-    files: list[bytes]
+    # (filename, start, end): each file is a byte range of the shared backing file
+    files: list[tuple[str, int, int]]
+    # Every upload is appended to this one temp file, so the corpus needs two fds
+    # (the file and its mapping) however many files it holds
+    backing: BinaryIO = field(default_factory=tempfile.TemporaryFile)
+    # Read-only mapping of backing, remapped as it grows; None while it is still empty
+    view: mmap.mmap | None = None
+    # Inverted index: word (case kept) -> ids (positions in files) containing it
+    index: dict[str, set[int]] = field(default_factory=dict)
+    # Content digest -> file id, so identical uploads are only stored once
+    digests: dict[bytes, int] = field(default_factory=dict)
+    # (term, max_hits) -> search_files result, least recently used first; cleared on every new file
+    search_cache: OrderedDict[tuple[str, int], str] = field(default_factory=OrderedDict)
+
+# Shared by every request for the life of the process. With stateless_http the
+# lifespan below is entered once per HTTP request, so it can't own this state.
+rag_context = RAGContext(files=[])
+# Serializes appends to the backing file from the upload worker threads
+_backing_lock = threading.Lock()
+
+@atexit.register
+def _close_files() -> None:
+    """Unmaps and closes the backing file at process shutdown, the temp file goes away with it"""
+    if rag_context.view is not None:
+        rag_context.view.close()
+    rag_context.backing.close()
 
 @asynccontextmanager
 async def server_lifespan(server: FastMCP) -> AsyncIterator[RAGContext]:
     """Manage application lifecycle with type-safe context"""
 
-    # Yield the context to the server
+    # Yield the shared store so it is also reachable as ctx.request_context.lifespan_context,
+    # the tools below use rag_context directly
     try:
-        yield RAGContext(files=[])
+        yield rag_context
     finally:
         # Cleanup resources on shutdown
-        pass  # Add cleanup code here if needed
+        pass  # the shared files outlive a single (stateless) request, see _close_files
+
+def _append(data: bytes) -> tuple[int, int]:
+    """Appends data to the backing file, so uploads live in the page cache instead of the Python heap, and returns its (start, end) byte range"""
+    with _backing_lock:
+        backing = rag_context.backing
+        start = backing.seek(0, os.SEEK_END)
+        backing.write(data)
+        backing.flush()
+    return start, start + len(data)
+
+def _remap(end: int) -> None:
+    """Maps the backing file again when the current view doesn't reach end. Only call it from the event loop, where searches run"""
+    view = rag_context.view
+    if end and (view is None or len(view) < end):
+        rag_context.view = mmap.mmap(rag_context.backing.fileno(), 0, access=mmap.ACCESS_READ)
+        if view is not None:
+            view.close()
+
+def _digest(data: bytes) -> bytes:
+    """Content digest used to detect identical uploads"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def _ingest(data: bytes) -> tuple[int, int, set[str]]:
+    """Spills an upload to the backing file and collects its distinct words, safe to run in a worker thread"""
+    text = data.decode('utf-8', errors='ignore')
+    start, end = _append(data)
+    return start, end, set(_WORD_RE.findall(text))
 
 # Create an MCP server with lifespan management
 mcp = FastMCP("RAGorama",
@@ -45,53 +115,108 @@ mcp = FastMCP("RAGorama",
             )
 
 @mcp.tool(description="This uploads a file to the server for RAG operations. Accepts file content as bytes and will convert it to a vector database")
-async def vectorize_file(file_content: bytes, filename: str = "uploaded_file", ctx: Context = None) -> str:
+async def vectorize_file(file_content: bytes, filename: str = "uploaded_file") -> str:
     """Uploads and vectorizes a file for RAG operations
 
     Args:
         file_content: The file content as bytes
         filename: Optional filename for the uploaded file
-        ctx: The context object (injected by FastMCP)
 
     Returns:
         Confirmation message about the file being vectorized
     """
     # TODO: VECTORIZE THE FILE HERE ....
-    # TODO: STORE IT IN THE CONTEXT FOR LATER USE
     # TODO: PROFIT ???
-    
-    # For now, just acknowledge the file was received
+
+    # Hashing, disk writes and tokenizing would block other tool calls, run them in a worker thread
+    digest = await asyncio.to_thread(_digest, file_content)
+    duplicate_of = rag_context.digests.get(digest)
+    if duplicate_of is None:
+        start, end, tokens = await asyncio.to_thread(_ingest, file_content)
+        # The same bytes may have been stored by a concurrent upload while we were away,
+        # in which case this copy just stays unused in the backing file
+        duplicate_of = rag_context.digests.get(digest)
+        if duplicate_of is None:
+            _remap(end)
+            file_id = len(rag_context.files)
+            rag_context.files.append((filename, start, end))
+            rag_context.digests[digest] = file_id
+            # Index every distinct word once so word searches are a single dict lookup
+            for token in tokens:
+                rag_context.index.setdefault(token, set()).add(file_id)
+            rag_context.search_cache.clear()
+    if duplicate_of is not None:
+        return f"File '{filename}' ({len(file_content)} bytes) is identical to already vectorized file '{rag_context.files[duplicate_of][0]}', skipping."
+
     file_size = len(file_content)
     return f"File '{filename}' ({file_size} bytes) successfully received and ready for vectorization. *clicks tongue*"
     
 
-@mcp.tool(description="""Search context files for a specific term.""")
-def search_files(term: str, ctx: Context = None) -> str:
-    """Searches the context files for a specific term"""
-    if not ctx or not hasattr(ctx, 'request_context') or not ctx.request_context.lifespan_context.files:
+def _iter_matches(rag: RAGContext, term: str) -> Iterator[int]:
+    """Yields the ids of the context files containing term, in upload order"""
+    if _WORD_RE.fullmatch(term):
+        # Single word: one lookup in the inverted index built at upload time
+        yield from sorted(rag.index.get(term, ()))
+    else:
+        # Phrases: words fully enclosed by the phrase must be whole words of any matching
+        # file, so the index rules out most files before we touch their bytes
+        enclosed = sorted(
+            (rag.index.get(m.group(), set()) for m in _WORD_RE.finditer(term)
+             if m.start() > 0 and m.end() < len(term)),
+            key=len,
+        )
+        # Start from the rarest word so a miss costs a few set lookups, not a walk over every file
+        candidates = enclosed[0].intersection(*enclosed[1:]) if enclosed else range(len(rag.files))
+        # Search the raw bytes, no need to decode every file on every query.
+        # find() on the mapping goes straight to memmem over the page cache.
+        needle = term.encode('utf-8')
+        files, view = rag.files, rag.view
+        if view is None:
+            return  # only empty files so far
+        for i in sorted(candidates):
+            _, start, end = files[i]
+            if view.find(needle, start, end) != -1:
+                yield i
+
+@mcp.tool(description="""Search context files for a specific term. Matching is case-sensitive. A single word only matches whole words (searching 'vector' does not find 'vectorize'), anything else is matched as an exact substring. Returns at most max_hits (1 or more) matches.""")
+def search_files(term: str, max_hits: int = 100) -> str:
+    """Searches the context files for a specific term, stopping after max_hits matches"""
+    if max_hits < 1:
+        return f"max_hits must be at least 1, got {max_hits}."
+
+    if not rag_context.files:
         return "No files available in context."
-    
-    # Simulate searching through files
-    results = []
-    for i, file_content in enumerate(ctx.request_context.lifespan_context.files):
-        try:
-            if term in file_content.decode('utf-8', errors='ignore'):
-                results.append(f"Found '{term}' in file {i}")
-        except Exception:
-            continue
-    
-    if not results:
-        return f"No occurrences of '{term}' found in context files."
-    
-    return "\n".join(results)
+
+    key = (term, max_hits)
+    if (result := rag_context.search_cache.get(key)) is not None:
+        rag_context.search_cache.move_to_end(key)
+        return result
+
+    # One extra match tells us whether the results were cut off
+    hits = list(islice(_iter_matches(rag_context, term), max_hits + 1))
+    result = "\n".join(f"Found '{term}' in file {i} ({rag_context.files[i][0]})" for i in hits[:max_hits])
+
+    if not result:
+        result = f"No occurrences of '{term}' found in context files."
+    elif len(hits) > max_hits:
+        result += f"\nStopped at max_hits={max_hits}, there may be more matches."
+
+    rag_context.search_cache[key] = result
+    if len(rag_context.search_cache) > _SEARCH_CACHE_SIZE:
+        rag_context.search_cache.popitem(last=False)
+    return result
+
+# Prompt payloads never change, build them once instead of on every prompt request
+_BUSINESS_REQUEST_PROMPT_EN = (Message("blahblah fix me Monarch", role="user"),)
+_BUSINESS_REQUEST_PROMPT_FR = (Message("blahblah fix me Monarch", role="user"),)
 
 @mcp.prompt(description="""This is the system prompt that will be used to generate the business request query""")
-def business_request_prompt(language: str) -> list[Message]:
+def business_request_prompt(language: str) -> list[PromptMessage]:
     """Prompt for business request"""
-    return [{
-        "role": "user",
-        "content": "blahblah fix me Monarch" if language == "fr" else "blahblah fix me Monarch"
-    }]
+    return list(_BUSINESS_REQUEST_PROMPT_FR if language == "fr" else _BUSINESS_REQUEST_PROMPT_EN)
 
 if __name__ == "__main__":
-    mcp.run(transport="streamable-http") # supported since 2.3.0
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.run(mcp.run_async(transport="streamable-http"))
+    else:
+        mcp.run(transport="streamable-http") # supported since 2.3.0